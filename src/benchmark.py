@@ -0,0 +1,331 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+import jinja2
+import lark
+from bytesnap.generator_cpp import GeneratorCPP
+from bytesnap.logger import Logger, LoggerLevel
+from bytesnap.parser import ASTProcessor
+
+
+RPC_VERSION = '0.1.0'
+DEFAULT_SHAPES = ['wide', 'deep', 'services', 'constants']
+DEFAULT_SCALES = [1, 2, 4, 8]
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.10
+# phases faster than this in both runs are too noisy to compare
+DEFAULT_MIN_SECONDS = 0.005
+DEFAULT_MAX_MSG_SIZE = '100000000'
+
+# fields of the synthesized structures cycle through these types
+SCALAR_TYPENAMES = [
+    'uint8_t', 'uint16_t', 'uint32_t', 'uint64_t',
+    'int8_t', 'int16_t', 'int32_t', 'int64_t',
+    'float', 'double', 'string'
+]
+
+# generation phases in the order of GeneratorCPP.generate
+GENERATE_PHASES = [
+    'select_modules',
+    'generate_header',
+    'generate_structs',
+    'generate_services',
+    'generate_cmake',
+    'generate_codec_benchmark',
+    'generate_vst',
+    'generate_readme1st',
+    'write_manifest'
+]
+
+
+def synthesize_wide(scale: int) -> str:
+    # many structures with many fields of every type, scalars and vectors
+    lines = []
+    for s in range(10 * scale):
+        lines.append(f'struct Wide{s} {{')
+        for f in range(100):
+            typename = SCALAR_TYPENAMES[f % len(SCALAR_TYPENAMES)]
+            if f % 3 == 2:
+                typename = f'vector<{typename}>'
+            lines.append(f'    field{f}: {typename}')
+        lines.append('}')
+    lines.append('service WideService {')
+    lines.append('    echo: Wide0 -> Wide0')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def synthesize_deep(scale: int) -> str:
+    # a chain of structures, each nesting the previous one as scalar and as vector
+    lines = ['struct Level0 {', '    value: uint32_t', '}']
+    for s in range(1, 25 * scale):
+        lines.append(f'struct Level{s} {{')
+        lines.append(f'    name: string')
+        lines.append(f'    child: Level{s - 1}')
+        lines.append(f'    children: vector<Level{s - 1}>')
+        lines.append('}')
+    lines.append('service DeepService {')
+    lines.append(f'    echo: Level{25 * scale - 1} -> Level{25 * scale - 1}')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def synthesize_services(scale: int) -> str:
+    # many services with many methods, unary, streaming and offloaded
+    lines = []
+    for s in range(10 * scale):
+        for m in range(10):
+            for kind in ['Request', 'Response']:
+                lines.append(f'struct S{s}M{m}{kind} {{')
+                lines.append('    id: uint64_t')
+                lines.append('    payload: vector<uint8_t>')
+                lines.append('}')
+    for s in range(10 * scale):
+        lines.append(f'service Service{s} {{')
+        for m in range(10):
+            stream = 'stream ' if m % 5 == 4 else ''
+            attributes = ' [offload]' if m % 5 == 3 else ''
+            lines.append(f'    method{m}: S{s}M{m}Request -> {stream}S{s}M{m}Response{attributes}')
+        lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def synthesize_constants(scale: int) -> str:
+    # huge constant vectors used as field initializers
+    lines = []
+    count = 5000 * scale
+    ints = ', '.join(str(i) for i in range(count))
+    hex_ints = ', '.join(hex(i) for i in range(count))
+    doubles = ', '.join(f'{i}.5' for i in range(count))
+    words = ', '.join(f'"w{i}"' for i in range(count))
+    lines.append(f'const INTS = {{ {ints} }}')
+    lines.append(f'const HEX_INTS = {{ {hex_ints} }}')
+    lines.append(f'const DOUBLES = {{ {doubles} }}')
+    lines.append(f'const WORDS = {{ {words} }}')
+    lines.append('struct Constants {')
+    lines.append('    ints: vector<int64_t> = INTS')
+    lines.append('    hex_ints: vector<uint32_t> = HEX_INTS')
+    lines.append('    doubles: vector<double> = DOUBLES')
+    lines.append('    words: vector<string> = WORDS')
+    lines.append('}')
+    lines.append('service ConstantsService {')
+    lines.append('    echo: Constants -> Constants')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+SYNTHESIZERS = {
+    'wide': synthesize_wide,
+    'deep': synthesize_deep,
+    'services': synthesize_services,
+    'constants': synthesize_constants
+}
+
+
+class BenchmarkGenerator(GeneratorCPP):
+    # measures the time spent in file writes, so generation phases can be reported without it
+
+
+    def __init__(self) -> None:
+        super().__init__(project='benchmark', version='0.0.1', description='Bytesnap generator benchmark', author='',
+                         rpc_version=RPC_VERSION, cache_dir=None)
+        self.write_time = 0.0
+
+
+    def write_output(self, output_folder: Path, name: str, content: str) -> str:
+        start = time.perf_counter()
+        result = super().write_output(output_folder, name, content)
+        self.write_time += time.perf_counter() - start
+        return result
+
+
+def run_phases(source_code: str, output_folder: Path) -> tuple[dict[str, float], dict[str, int], dict[str, int]]:
+    # one generator run split into its phases, returns seconds and traced peak memory per phase and counters
+    phases = dict()
+    peaks = dict()
+
+    def measure(name: str, function):
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = function()
+        phases[name] = time.perf_counter() - start
+        if tracemalloc.is_tracing():
+            peaks[name] = tracemalloc.get_traced_memory()[1]
+        return result
+
+    # the IDL is loaded as GeneratorCPP.generate loads it: without a cache, then filling and hitting an empty cache
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        idl_path = Path(tmp_dir) / 'benchmark.idl'
+        idl_path.write_text(source_code)
+        cache_dir = Path(tmp_dir) / 'cache'
+        ASTProcessor.parser = None
+        parser = measure('grammar', ASTProcessor.build_parser)
+        # parsing and processing the syntax tree on their own, from_file adds the file, import and cache handling
+        ast = measure('parse', lambda: parser.parse(source_code))
+        if not measure('process_ast', lambda: ASTProcessor().process_ast(ast)):
+            raise ValueError('synthesized IDL is not valid')
+        for name, directory in [('from_file', None), ('from_file_cache_miss', cache_dir), ('from_file_cache_hit', cache_dir)]:
+            ast_processor = measure(name, lambda: ASTProcessor.from_file(idl_path, RPC_VERSION, directory))
+            if ast_processor is None:
+                raise ValueError('synthesized IDL is not valid')
+
+    generator = measure('load_templates', BenchmarkGenerator)
+    generator.manifest = dict()
+    generator.module_manifest = dict()
+    generator.previous_manifest = dict()
+    steps = {
+        'select_modules': lambda: generator.select_modules(ast_processor, output_folder, idl_path.parent, DEFAULT_MAX_MSG_SIZE),
+        'generate_header': lambda: generator.generate_header(output_folder),
+        'generate_structs': lambda: generator.generate_structs(ast_processor, output_folder),
+        'generate_services': lambda: generator.generate_services(ast_processor, output_folder, DEFAULT_MAX_MSG_SIZE),
+        'generate_cmake': lambda: generator.generate_cmake(ast_processor, generator.project, generator.version, output_folder, '/usr/include/boost'),
+        'generate_codec_benchmark': lambda: generator.generate_codec_benchmark(ast_processor, output_folder),
+        'generate_vst': lambda: generator.generate_vst(output_folder),
+        'generate_readme1st': lambda: generator.generate_readme1st(ast_processor, output_folder),
+        'write_manifest': lambda: generator.write_manifest(output_folder)
+    }
+    for name in GENERATE_PHASES:
+        write_time = generator.write_time
+        measure(name, steps[name])
+        # file writes are reported as a phase of their own
+        phases[name] -= generator.write_time - write_time
+    phases['write_output'] = generator.write_time
+    counters = {
+        'structs': len(ast_processor.structs),
+        'services': len(ast_processor.services),
+        'methods': sum(len(service.methods) for service in ast_processor.services.values()),
+        'files': len(generator.manifest),
+        'output_bytes': sum(file.stat().st_size for file in output_folder.iterdir())
+    }
+    return phases, peaks, counters
+
+
+def run_case(shape: str, scale: int, repeat: int) -> dict:
+    source_code = SYNTHESIZERS[shape](scale)
+    best = None
+    for _ in range(repeat):
+        # every run writes into an empty directory, so all files are written
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            phases, _, counters = run_phases(source_code, Path(tmp_dir))
+        best = phases if best is None else {name: min(best[name], phases[name]) for name in best}
+    # a separate run for memory, tracing slows everything down too much to take its times
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        _, peaks, _ = run_phases(source_code, Path(tmp_dir))
+    tracemalloc.stop()
+    return {
+        'shape': shape,
+        'scale': scale,
+        'idl_lines': source_code.count('\n'),
+        'idl_bytes': len(source_code.encode()),
+        **counters,
+        'seconds': {name: round(value, 6) for name, value in best.items()},
+        'total_seconds': round(sum(best.values()), 6),
+        'peak_traced_bytes': peaks,
+        'peak_traced_bytes_max': max(peaks.values())
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.realpath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def max_rss_bytes() -> int | None:
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_seconds: float) -> list[str]:
+    # phases slower than the baseline by more than the threshold
+    regressions = []
+    baseline_cases = {(case['shape'], case['scale']): case for case in baseline.get('cases', [])}
+    for case in results['cases']:
+        previous = baseline_cases.get((case['shape'], case['scale']))
+        if previous is None:
+            continue
+        # the totals are compared over the phases both runs measured, older baselines have other phases
+        common = [name for name in case['seconds'] if name in previous['seconds']]
+        totals = (sum(case['seconds'][name] for name in common), sum(previous['seconds'][name] for name in common))
+        for name, seconds in list(case['seconds'].items()) + [('total', totals[0])]:
+            before = totals[1] if name == 'total' else previous['seconds'].get(name)
+            if before is None or max(before, seconds) < min_seconds:
+                continue
+            change = (seconds - before) / before if before > 0 else float('inf')
+            marker = ' REGRESSION' if change > threshold else ''
+            line = f"{case['shape']:>10} x{case['scale']:<3} {name:<20} {before:10.4f}s -> {seconds:10.4f}s {change:+8.1%}{marker}"
+            print(line)
+            if marker:
+                regressions.append(line)
+    return regressions
+
+
+def print_case(case: dict) -> None:
+    phases = ' '.join(f'{name}={seconds:.4f}' for name, seconds in case['seconds'].items() if seconds >= 0.0005)
+    print(f"{case['shape']:>10} x{case['scale']:<3} {case['idl_lines']:>7} lines {case['total_seconds']:8.3f}s "
+          f"{case['peak_traced_bytes_max'] / 2**20:8.1f} MiB  {phases}")
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description='Benchmark the Bytesnap generator on synthesized IDL files')
+    argument_parser.add_argument('--shapes', nargs='+', choices=list(SYNTHESIZERS), default=DEFAULT_SHAPES, help='IDL shapes to synthesize')
+    argument_parser.add_argument('--scales', nargs='+', type=int, default=DEFAULT_SCALES, help='size multipliers of every shape')
+    argument_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='runs per case, the fastest time of every phase is kept')
+    argument_parser.add_argument('--output', type=Path, default=None, help='write the results as JSON to this file')
+    argument_parser.add_argument('--compare', type=Path, default=None, help='JSON results of an earlier run to compare with')
+    argument_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='relative slowdown reported as regression')
+    argument_parser.add_argument('--min-seconds', type=float, default=DEFAULT_MIN_SECONDS, help='phases faster than this are not compared')
+    argument_parser.add_argument('--save-idl', type=Path, default=None, help='also write the synthesized IDL files to this directory')
+    args = argument_parser.parse_args()
+
+    Logger(True, False).set_level(LoggerLevel.ERROR)
+
+    results = {
+        'generator': RPC_VERSION,
+        'revision': git_revision(),
+        'date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'lark': lark.__version__,
+        'jinja2': jinja2.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeat': args.repeat,
+        'cases': []
+    }
+    for shape in args.shapes:
+        for scale in args.scales:
+            if not args.save_idl is None:
+                args.save_idl.mkdir(parents=True, exist_ok=True)
+                (args.save_idl / f'{shape}_{scale}.idl').write_text(SYNTHESIZERS[shape](scale))
+            case = run_case(shape, scale, args.repeat)
+            print_case(case)
+            results['cases'].append(case)
+    results['max_rss_bytes'] = max_rss_bytes()
+
+    if not args.output is None:
+        args.output.write_text(json.dumps(results, indent=4) + '\n')
+        print(f'Results written to {args.output}')
+
+    if not args.compare is None:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.threshold, args.min_seconds)
+        if regressions:
+            print(f'{len(regressions)} phases slower by more than {args.threshold:.0%}')
+            sys.exit(1)
+        print(f'No phase slower by more than {args.threshold:.0%}')
@@ -5,6 +5,7 @@ from inquirer.themes import GreenPassion
 from pprint import pprint
 from pathlib import Path
 from bytesnap.generator_cpp import GeneratorCPP
+from bytesnap.generator_python import GeneratorPython
 from bytesnap.logger import Logger, LoggerLevel
 
 
@@ -17,6 +18,7 @@ SOURCE_IDL = 'source idl'
 OUTPUT_DIR = 'output dir'
 BOOST_DIR = 'boost dir'
 MAX_MESSAGE_SIZE = 'max message size'
+PYTHON_CODEC = 'python codec'
 
 
 def read_local_cfg() -> dict[str, str] | None:
@@ -53,6 +55,8 @@ if __name__ == "__main__":
         inquirer.Text(MAX_MESSAGE_SIZE, message="Maximum size of the message in bytes", 
                       default=None if cfg is None else cfg[MAX_MESSAGE_SIZE],
                       validate=lambda answers, max_msg_size: max_msg_size.isdigit()),
+        inquirer.Confirm(PYTHON_CODEC, message="Generate Python codec of the structures",
+                         default=False if cfg is None else cfg.get(PYTHON_CODEC, False)),
     ]
 
     answers = inquirer.prompt(questions, theme=GreenPassion())
@@ -76,5 +80,14 @@ if __name__ == "__main__":
             boost_path,
             answers[MAX_MESSAGE_SIZE]
         )
+        if answers[PYTHON_CODEC]:
+            gen_python = GeneratorPython(
+                project=answers[PROJECT_NAME],
+                version=answers[VERSION_STRING],
+                description=answers[DESCRIPTION],
+                author=answers[AUTHOR],
+                rpc_version='0.1.0'
+            )
+            gen_python.generate(idl_path, output_path)
     except TypeError:
         exit
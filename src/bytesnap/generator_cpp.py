@@ -1,17 +1,56 @@
 from datetime import datetime
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
 import os
 from pathlib import Path
 import traceback
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from bytesnap.logger import Logger, LoggerLevel
 
-from bytesnap.parser import ASTProcessor, ServiceDescriptor, StructDescriptor
+from bytesnap.parser import ASTProcessor, ModuleDescriptor, ServiceDescriptor, StructDescriptor
+
+
+# content hashes of the generated files, used to report stale files on the next run
+MANIFEST_FILENAME = 'bytesnap_manifest.json'
+
+# validated IDL files are cached here, keyed by their content and the generator version
+DEFAULT_CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'bytesnap'
+
+# structures are rendered in worker processes if every worker gets at least this many
+PARALLEL_STRUCTS_PER_WORKER = 256
+
+
+def create_environment(templates_path: Path, cache_dir: Path | None) -> Environment:
+    # compiled templates are kept in the cache directory, jinja recompiles them when the template changes
+    bytecode_cache = None
+    if not cache_dir is None:
+        try:
+            (cache_dir / 'jinja').mkdir(parents=True, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(str(cache_dir / 'jinja'))
+        except OSError as e:
+            Logger.log(None, LoggerLevel.WARNING, f'Template cache {cache_dir / "jinja"} not usable: {e}')
+    return Environment(loader=FileSystemLoader(str(templates_path)), bytecode_cache=bytecode_cache)
+
+
+# template of the worker process rendering structures
+_struct_template = None
+
+
+def init_struct_renderer(templates_path: Path, cache_dir: Path | None) -> None:
+    global _struct_template
+    _struct_template = create_environment(templates_path, cache_dir).get_template('struct.hpp.txt')
+
+
+def render_struct(context: dict) -> str:
+    return _struct_template.render(context)
 
 
 class GeneratorCPP:
 
 
-    def __init__(self, project: str, version: str, description: str, author: str, rpc_version: str) -> None:
+    def __init__(self, project: str, version: str, description: str, author: str, rpc_version: str, timestamp: bool = False,
+                 cache_dir: Path | None = DEFAULT_CACHE_DIR) -> None:
         self.sizeof_table = {
             'uint8_t': 1,
             'uint16_t': 2,
@@ -24,33 +63,145 @@ class GeneratorCPP:
             'float': 4,
             'double': 8
         }
+        # integers written as varints (zigzag for signed) by the compact encoding
+        self.varint_typenames = {
+            'uint16_t', 'uint32_t', 'uint64_t',
+            'int16_t', 'int32_t', 'int64_t'
+        }
 
         self.project = project
         self.version = version
         self.description = description
+        self.rpc_version = rpc_version
+        self.cache_dir = cache_dir
+        self.manifest = dict()
+        self.module_manifest = dict()
+        self.previous_manifest = dict()
+        self.written_files = 0
+        self.unchanged_files = 0
 
         Logger.log(None, LoggerLevel.INFO, f'Loading templates')
-        this_path = os.path.dirname(os.path.realpath(__file__))
-        self.jinja_env = Environment(loader=FileSystemLoader(f"{this_path}/templates"))
+        self.templates_path = Path(os.path.realpath(__file__)).parent / 'templates'
+        self.jinja_env = create_environment(self.templates_path, cache_dir)
         template = self.jinja_env.get_template("preamble.txt")
         self.preamble = template.render(
             project=project, version=version, description=description, author=author,
-            date=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            date=datetime.now().strftime("%Y-%m-%d %H:%M:%S") if timestamp else None,
             rpc_version=rpc_version)
         Logger.log(None, LoggerLevel.INFO, f'Templates loaded ok')
 
     
+    def write_output(self, output_folder: Path, name: str, content: str) -> str:
+        # record the content hash, rewrite the file only if its content changed to keep build timestamps
+        self.manifest[name] = hashlib.sha256(content.encode()).hexdigest()
+        Path(output_folder).mkdir(parents=True, exist_ok=True)
+        file_path = Path(output_folder) / name
+        if file_path.is_file() and file_path.read_text() == content:
+            self.unchanged_files += 1
+            return name
+        file_path.write_text(content)
+        self.written_files += 1
+        return name
+
+
+    def read_manifest(self, output_folder: Path) -> dict:
+        manifest_path = Path(output_folder) / MANIFEST_FILENAME
+        if manifest_path.is_file():
+            try:
+                manifest = json.loads(manifest_path.read_text())
+                if isinstance(manifest.get('files', dict()), dict) and isinstance(manifest.get('modules', dict()), dict):
+                    return manifest
+            except ValueError:
+                pass
+            Logger.log(None, LoggerLevel.WARNING, f'Ignoring unreadable manifest {manifest_path}')
+        return dict()
+
+
+    def write_manifest(self, output_folder: Path) -> None:
+        # files listed by the previous manifest but not generated any more are stale
+        manifest_path = Path(output_folder) / MANIFEST_FILENAME
+        previous_files = self.previous_manifest.get('files', dict())
+        for name in sorted(set(previous_files) - set(self.manifest)):
+            if (Path(output_folder) / name).exists():
+                Logger.log(None, LoggerLevel.WARNING, f'Stale file {name} is not generated any more')
+        manifest = {
+            'generator': self.rpc_version,
+            'files': dict(sorted(self.manifest.items())),
+            'modules': dict(sorted(self.module_manifest.items()))
+        }
+        content = json.dumps(manifest, indent=4) + '\n'
+        if not manifest_path.is_file() or manifest_path.read_text() != content:
+            manifest_path.write_text(content)
+
+
     def cpp_sizeof(self, typename: str) -> int:
         return self.sizeof_table.get(typename, 0)
 
 
+    def fixed_encoded_size(self, structname: str, structs: dict[str, StructDescriptor], cache: dict[str, int | None], compact: bool = False) -> int | None:
+        # encoded size of the structure if it consists of fixed-size scalars only, None otherwise
+        if structname in cache:
+            return cache[structname]
+        cache[structname] = None
+        size = 0
+        for fieldname in structs[structname].field_names:
+            field = structs[structname].fields[fieldname]
+            if field.is_vector or field.typename == 'string' or (compact and field.typename in self.varint_typenames):
+                return None
+            if field.is_userdefined:
+                field_size = self.fixed_encoded_size(field.typename, structs, cache, compact)
+                if field_size is None:
+                    return None
+                size += field_size
+            else:
+                size += self.cpp_sizeof(field.typename)
+        cache[structname] = size
+        return size
+
+
+    def generation_key(self, ast_processor: ASTProcessor, max_msg_size: str) -> str:
+        # everything besides the module itself that the generated structures and services depend on
+        digest = hashlib.sha256()
+        digest.update(self.preamble.encode())
+        digest.update(self.project.encode())
+        digest.update(json.dumps(ast_processor.options, sort_keys=True).encode())
+        digest.update(str(max_msg_size).encode())
+        digest.update(Path(__file__).read_bytes())
+        for template_path in sorted(self.templates_path.iterdir()):
+            digest.update(template_path.name.encode())
+            digest.update(template_path.read_bytes())
+        return digest.hexdigest()
+
+
+    def select_modules(self, ast_processor: ASTProcessor, output_folder: Path, main_folder: Path, max_msg_size: str) -> dict[str, ModuleDescriptor]:
+        # modules generated by the previous run from the same module key are kept as they are,
+        # the module key covers the module source and the sources of all modules it imports
+        generation_key = self.generation_key(ast_processor, max_msg_size)
+        previous_modules = self.previous_manifest.get('modules', dict())
+        previous_files = self.previous_manifest.get('files', dict())
+        selected = dict()
+        for module in ast_processor.modules.values():
+            name = Path(os.path.relpath(module.name, main_folder)).as_posix()
+            key = hashlib.sha256(f'{generation_key}{module.key}'.encode()).hexdigest()
+            previous = previous_modules.get(name, dict())
+            files = previous.get('files', [])
+            if previous.get('key') == key and all(file in previous_files and (Path(output_folder) / file).is_file() for file in files):
+                for file in files:
+                    self.manifest[file] = previous_files[file]
+                self.unchanged_files += len(files)
+                self.module_manifest[name] = previous
+            else:
+                self.module_manifest[name] = {'key': key, 'files': []}
+                selected[name] = module
+        Logger.log(None, LoggerLevel.INFO, f'{len(ast_processor.modules) - len(selected)} of {len(ast_processor.modules)} modules unchanged')
+        return selected
+
+
     def generate_header(self, output_folder: Path) -> None:
         Logger.log(None, LoggerLevel.INFO, f'Generating bytesnap.hpp')
         template = self.jinja_env.get_template("bytesnap.hpp.txt")
         content = template.render(preamble=self.preamble)
-        Path(output_folder).mkdir(parents=True, exist_ok=True)
-        file_path = Path(output_folder) / "bytesnap.hpp"
-        file_path.write_text(content)
+        self.write_output(output_folder, "bytesnap.hpp", content)
         Logger.log(None, LoggerLevel.INFO, f'bytesnap.hpp generated ok')
 
 
@@ -70,191 +221,273 @@ class GeneratorCPP:
 
         template = self.jinja_env.get_template("CMakeLists.txt.txt")
         content = template.render(preamble=self.preamble,
+                                  project_name=project_name,
                                   servicenames=servicenames, 
                                   methodnames=methodnames,
+                                  compression=ast_processor.options.get('compression', 'none'),
                                   version_string=version_string,
                                   boost_pathname=Path(boost_pathname).as_posix())
-        Path(output_folder).mkdir(parents=True, exist_ok=True)
-        file_path = Path(output_folder) / "CMakeLists.txt"
-        file_path.write_text(content)
+        self.write_output(output_folder, "CMakeLists.txt", content)
         Logger.log(None, LoggerLevel.INFO, f'CMakeLisits.txt generated ok')
 
 
-    def generate_structs(self, ast_processor: ASTProcessor, output_folder: Path) -> None:
-        Logger.log(None, LoggerLevel.INFO, f'Generating structures')
+    def generate_codec_benchmark(self, ast_processor: ASTProcessor, output_folder: Path) -> None:
+        Logger.log(None, LoggerLevel.INFO, f'Generating codec benchmark')
         #namespace = ast_processor.options.get("namespace", None)
         namespace = self.project
+        structs = []
         for structname, struct in ast_processor.structs.items():
-            self.generate_struct(output_folder, structname, struct, namespace)
+            fields = []
+            for fieldname in struct.field_names:
+                field = struct.fields[fieldname]
+                fields.append({
+                    'name': fieldname,
+                    'typename': field.typename,
+                    'is_vector': field.is_vector,
+                    'is_userdefined': field.is_userdefined,
+                    'length_spec': field.length_spec
+                })
+            structs.append({'name': structname, 'fields': fields})
+        template = self.jinja_env.get_template("codec_benchmark.cpp.txt")
+        content = template.render(preamble=self.preamble,
+                                  structs=structs,
+                                  pmr=ast_processor.options.get('allocator', 'std') == 'pmr',
+                                  namespace=namespace)
+        self.write_output(output_folder, "codec_benchmark.cpp", content)
+        Logger.log(None, LoggerLevel.INFO, f'codec benchmark generated ok')
+
+
+    def uses_allocator(self, structname: str, structs: dict[str, StructDescriptor], cache: dict[str, bool]) -> bool:
+        # True if the structure holds strings or vectors, directly or in nested structures
+        if structname in cache:
+            return cache[structname]
+        result = False
+        for fieldname in structs[structname].field_names:
+            field = structs[structname].fields[fieldname]
+            if field.is_vector or field.typename == 'string' or (field.is_userdefined and self.uses_allocator(field.typename, structs, cache)):
+                result = True
+                break
+        cache[structname] = result
+        return result
+
+
+    def generate_structs(self, ast_processor: ASTProcessor, output_folder: Path, structnames: set[str] | None = None) -> None:
+        Logger.log(None, LoggerLevel.INFO, f'Generating structures')
+        #namespace = ast_processor.options.get("namespace", None)
+        namespace = self.project
+        compact = ast_processor.options.get('encoding', 'fixed') == 'compact'
+        pmr = ast_processor.options.get('allocator', 'std') == 'pmr'
+        fixed_sizes = dict()
+        allocating = dict()
+        for structname in ast_processor.structs:
+            self.fixed_encoded_size(structname, ast_processor.structs, fixed_sizes, compact)
+            self.uses_allocator(structname, ast_processor.structs, allocating)
+        contexts = [self.struct_context(structname, struct, namespace, fixed_sizes, compact, allocating if pmr else None)
+                    for structname, struct in ast_processor.structs.items() if structnames is None or structname in structnames]
+        workers = min(os.cpu_count() or 1, len(contexts) // PARALLEL_STRUCTS_PER_WORKER)
+        if workers > 1:
+            # rendering is CPU bound, large schemas are spread over processes, files are still written here
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_struct_renderer,
+                                     initargs=(self.templates_path, self.cache_dir)) as executor:
+                sources = list(executor.map(render_struct, contexts, chunksize=PARALLEL_STRUCTS_PER_WORKER // 4))
+        else:
+            template = self.jinja_env.get_template('struct.hpp.txt')
+            sources = [template.render(context) for context in contexts]
+        for context, src in zip(contexts, sources):
+            self.write_output(output_folder, f"{context['structname'].lower()}.hpp", src)
         Logger.log(None, LoggerLevel.INFO, f'Structures generated ok')
 
 
-    def generate_struct(self, output_folder: Path, structname: str, struct: StructDescriptor, namespace: str | None):
-        # build include headers
-        headers = ''
+    def struct_context(self, structname: str, struct: StructDescriptor, namespace: str | None,
+                       fixed_sizes: dict[str, int | None], compact: bool = False, allocating: dict[str, bool] | None = None) -> dict:
+        # precompute everything struct.hpp.txt needs, a codec plan entry per field selects its struct_codec.txt macros
+        pmr = not allocating is None and allocating[structname]
+        std_prefix = 'std::pmr::' if not allocating is None else 'std::'
+        headers = []
+        fields = []
+        init_list = []
+        alloc_init_list = []
+        copy_init_list = []
+        move_init_list = []
+        constant_size = 0
         for fieldname in struct.field_names:
             field = struct.fields[fieldname]
+            varint = compact and field.typename in self.varint_typenames
             if field.is_userdefined:
-                headers += f'#include "{field.typename.lower()}.hpp"\n'
+                headers.append(field.typename)
 
-        # build fields
-        init_list = []
-        fields = ''
-        for fieldname in struct.field_names:
-            field = struct.fields[fieldname]
-            typename = f'std::{field.typename}' if field.typename == 'string' else field.typename
+            # declaration, with pmr containers taking the allocator of the structure if allocating is given
+            typename = f'{std_prefix}{field.typename}' if field.typename == 'string' else field.typename
             if field.is_vector:
-                typename = f'std::vector<{typename}>'
-            fieldtxt = f'    {typename} {fieldname}'
+                typename = f'{std_prefix}vector<{typename}>'
+            field_allocating = pmr and (field.is_vector or field.typename == 'string' or (field.is_userdefined and allocating[field.typename]))
+            decl = f'    {typename} {fieldname}'
             if not field.assigned_value is None:
                 if isinstance(field.assigned_value, list):
-                    fieldtxt += f" = {{ {', '.join(str(v) for v in field.assigned_value)} }}"
+                    value = f"{{ {', '.join(str(v) for v in field.assigned_value)} }}"
                 else:
-                    fieldtxt += f" = {field.assigned_value}"
+                    value = f"{field.assigned_value}"
+                if field_allocating:
+                    alloc_init_list.append(f'{fieldname}({value}, alloc)')
+                else:
+                    decl += f" = {value}"
             elif not field.length_spec is None:
-                # fieldtxt += f'({field.length_spec})'
                 init_list.append(f'{fieldname}({field.length_spec})')
-            fieldtxt += ";\n"
-            fields += fieldtxt
-
-        # build ctor
-        init_list_txt = ''
-        if init_list:
-            init_list_txt = ' : ' + ', '.join(init_list)
-        ctor = f'''    {structname}(){init_list_txt} {{}}
-'''
+                alloc_init_list.append(f'{fieldname}({field.length_spec}, alloc)')
+            elif field_allocating:
+                alloc_init_list.append(f'{fieldname}(alloc)')
+            if field_allocating:
+                copy_init_list.append(f'{fieldname}(other.{fieldname}, alloc)')
+                move_init_list.append(f'{fieldname}(std::move(other.{fieldname}), alloc)')
+            else:
+                copy_init_list.append(f'{fieldname}(other.{fieldname})')
+                move_init_list.append(f'{fieldname}(other.{fieldname})')
 
-        # build encode method
-        encode_body = ''
-        for fieldname in struct.field_names:
-            field = struct.fields[fieldname]
+            # encoded size terms, constant parts are summed up here
+            if varint and field.typename.startswith('int'):
+                varint_size = 'bytesnap::varint_size(bytesnap::zigzag_encode({}))'
+            else:
+                varint_size = 'bytesnap::varint_size({})'
+            size = []
             if field.is_vector:
+                if compact:
+                    size.append(f'size += bytesnap::varint_size(source.{fieldname}.size());')
+                else:
+                    constant_size += 4
                 if field.typename == 'string':
-                    template = self.jinja_env.get_template("vector_string_field_encode.txt")
-                    encode_body += template.render(fieldname=fieldname)
-                    encode_body += '\n'
+                    item_prefix_size = 'bytesnap::varint_size(item.size())' if compact else '4'
+                    size.append(f'for (const auto& item : source.{fieldname}) size += {item_prefix_size} + item.size();')
                 elif field.is_userdefined:
-                    template = self.jinja_env.get_template("vector_userdef_field_encode.txt")
-                    encode_body += template.render(fieldname=fieldname, field_typename=field.typename)
-                    encode_body += '\n'
-                else:
-                    sizeof = self.cpp_sizeof(field.typename)
-                    if sizeof > 1:
-                        template = self.jinja_env.get_template("vector_other_field_encode.txt")
-                        encode_body += template.render(fieldname=fieldname, field_typename=field.typename)
-                        encode_body += '\n'
+                    if fixed_sizes[field.typename] is None:
+                        size.append(f'for (const auto& item : source.{fieldname}) size += {field.typename}::encoded_size(item);')
                     else:
-                        template = self.jinja_env.get_template("vector_other_1_field_encode.txt")
-                        encode_body += template.render(fieldname=fieldname)
-                        encode_body += '\n'
+                        size.append(f'size += source.{fieldname}.size() * {field.typename}::FIXED_ENCODED_SIZE;')
+                elif varint:
+                    size.append(f'for (const auto item : source.{fieldname}) size += {varint_size.format("item")};')
+                else:
+                    size.append(f'size += source.{fieldname}.size() * {self.cpp_sizeof(field.typename)};')
             else:
                 if field.typename == 'string':
-                    template = self.jinja_env.get_template("scalar_string_field_encode.txt")
-                    encode_body += template.render(fieldname=fieldname)
-                    encode_body += '\n'
+                    if compact:
+                        size.append(f'size += bytesnap::varint_size(source.{fieldname}.size()) + source.{fieldname}.size();')
+                    else:
+                        constant_size += 4
+                        size.append(f'size += source.{fieldname}.size();')
                 elif field.is_userdefined:
-                    template = self.jinja_env.get_template("scalar_userdef_field_encode.txt")
-                    encode_body += template.render(fieldname=fieldname, field_typename=field.typename)
-                    encode_body += '\n'
+                    if fixed_sizes[field.typename] is None:
+                        size.append(f'size += {field.typename}::encoded_size(source.{fieldname});')
+                    else:
+                        constant_size += fixed_sizes[field.typename]
+                elif varint:
+                    size.append(f'size += {varint_size.format(f"source.{fieldname}")};')
                 else:
-                    template = self.jinja_env.get_template("scalar_other_field_encode.txt")
-                    encode_body += template.render(fieldname=fieldname, field_typename=field.typename)
-                    encode_body += '\n'
-        template = self.jinja_env.get_template("encode.txt")
-        encode = template.render(structname=structname, encode_body=encode_body)
-        encode += '\n'
-        
-        # build decode method
-        decode_body = ''
-        for fieldname in struct.field_names:
-            field = struct.fields[fieldname]
+                    constant_size += self.cpp_sizeof(field.typename)
+
+            # codec kind, naming the struct_codec.txt macros, and the read-only view member
             if field.is_vector:
                 if field.typename == 'string':
-                    template = self.jinja_env.get_template("vector_string_field_decode.txt")
-                    decode_body += template.render(fieldname=fieldname)
-                    decode_body += '\n'
+                    kind = 'vector_string'
+                    view_decl = f"    {'bytesnap::compact_string_list_view' if compact else 'bytesnap::string_list_view'} {fieldname};"
                 elif field.is_userdefined:
-                    template = self.jinja_env.get_template("vector_userdef_field_decode.txt")
-                    decode_body += template.render(fieldname=fieldname, field_typename=field.typename)
-                    decode_body += '\n'
+                    kind = 'vector_userdef'
+                    view_decl = f'    bytesnap::struct_list_view<{field.typename}View> {fieldname};'
                 else:
-                    sizeof = self.cpp_sizeof(field.typename)
-                    if sizeof > 1:
-                        template = self.jinja_env.get_template("vector_other_field_decode.txt")
-                        decode_body += template.render(fieldname=fieldname, field_typename=field.typename)
-                        decode_body += '\n'
-                    else:
-                        template = self.jinja_env.get_template("vector_other_1_field_decode.txt")
-                        decode_body += template.render(fieldname=fieldname, field_typename=field.typename)
-                        decode_body += '\n'
+                    kind = 'vector_other' if self.cpp_sizeof(field.typename) > 1 else 'vector_other_1'
+                    view_decl = f"    {'bytesnap::varint_list_view' if varint else 'bytesnap::array_view'}<{field.typename}> {fieldname};"
+                view_decode = 'vector_other_field_view_decode' if kind == 'vector_other_1' else f'{kind}_field_view_decode'
             else:
                 if field.typename == 'string':
-                    template = self.jinja_env.get_template("scalar_string_field_decode.txt")
-                    decode_body += template.render(fieldname=fieldname)
-                    decode_body += '\n'
+                    kind = 'scalar_string'
+                    view_decl = f'    std::string_view {fieldname};'
                 elif field.is_userdefined:
-                    template = self.jinja_env.get_template("scalar_userdef_field_decode.txt")
-                    decode_body += template.render(fieldname=fieldname, field_typename=field.typename)
-                    decode_body += '\n'
+                    kind = 'scalar_userdef'
+                    view_decl = f'    bytesnap::struct_view<{field.typename}View> {fieldname};'
                 else:
-                    template = self.jinja_env.get_template("scalar_other_field_decode.txt")
-                    decode_body += template.render(fieldname=fieldname, field_typename=field.typename)
-                    decode_body += '\n'
-        template = self.jinja_env.get_template("decode.txt")
-        decode = template.render(structname=structname, decode_body=decode_body)
-        decode += '\n'
-
-        if namespace is None:
-            namespace_begin = ''
-            namespace_end = ''
+                    kind = 'scalar_other'
+                    view_decl = f'    {field.typename} {fieldname}{{}};'
+                view_decode = 'scalar_other_field_decode' if kind == 'scalar_other' else f'{kind}_field_view_decode'
+
+            fields.append({
+                'name': fieldname,
+                'typename': field.typename,
+                'varint': varint,
+                'decl': decl + ';',
+                'view_decl': view_decl,
+                'size': size,
+                'encode': f'{kind}_field_encode',
+                'decode': f'{kind}_field_decode',
+                'view_decode': view_decode
+            })
+
+        # build ctor
+        if pmr:
+            # allocator-aware structure, containers construct it with their own memory resource
+            ctor = f'''    using allocator_type = std::pmr::polymorphic_allocator<>;
+
+    {structname}() : {structname}(allocator_type{{}}) {{}}
+    explicit {structname}(const allocator_type& alloc) : {', '.join(alloc_init_list)} {{}}
+    {structname}(const {structname}& other, const allocator_type& alloc) : {', '.join(copy_init_list)} {{}}
+    {structname}({structname}&& other, const allocator_type& alloc) : {', '.join(move_init_list)} {{}}
+    {structname}(const {structname}&) = default;
+    {structname}({structname}&&) = default;
+    {structname}& operator=(const {structname}&) = default;
+    {structname}& operator=({structname}&&) = default;
+'''
         else:
-            namespace_begin = f'namespace {namespace} {{'
-            namespace_end = f'}} // namespace {namespace}'
+            init_list_txt = ''
+            if init_list:
+                init_list_txt = ' : ' + ', '.join(init_list)
+            ctor = f'''    {structname}(){init_list_txt} {{}}
+'''
 
-        # build whole source
-        template = self.jinja_env.get_template("hpp.txt")
-        src = template.render(
-            preamble=self.preamble,
-            structname_lower=structname.lower(),
-            datetime_string=datetime.now().strftime("%B %d, %Y %I:%M%p"),
-            structname_upper=structname.upper(),
-            headers=headers,
-            namespace_begin=namespace_begin,
-            structname=structname,
-            fields=fields,
-            ctor=ctor,
-            encode=encode,
-            decode=decode,
-            namespace_end=namespace_end
-        )
-        Path(output_folder).mkdir(parents=True, exist_ok=True)
-        file_path = Path(output_folder) / f'{structname.lower()}.hpp'
-        file_path.write_text(src)
+        return {
+            'preamble': self.preamble,
+            'namespace': namespace,
+            'structname': structname,
+            'headers': headers,
+            'fields': fields,
+            'ctor': ctor,
+            'fixed_size': fixed_sizes[structname],
+            'constant_size': constant_size,
+            'compact': compact
+        }
 
 
-    def generate_services(self, ast_processor: ASTProcessor, output_folder: Path, max_msg_size: str) -> None:
+    def generate_services(self, ast_processor: ASTProcessor, output_folder: Path, max_msg_size: str, servicenames: set[str] | None = None) -> dict[str, list[str]]:
         Logger.log(None, LoggerLevel.INFO, f'Generating services')
         #namespace = ast_processor.options.get("namespace", None)
         namespace = self.project
+        pmr_structs = None
+        if ast_processor.options.get('allocator', 'std') == 'pmr':
+            allocating = dict()
+            pmr_structs = {structname for structname in ast_processor.structs if self.uses_allocator(structname, ast_processor.structs, allocating)}
+        files = dict()
         for servicename, service in ast_processor.services.items():
-            self.generate_service(output_folder, servicename, service, namespace, max_msg_size)
+            if servicenames is None or servicename in servicenames:
+                files[servicename] = self.generate_service(output_folder, servicename, service, namespace, max_msg_size, ast_processor.compression_threshold, pmr_structs)
         Logger.log(None, LoggerLevel.INFO, f'Services generated ok')
+        return files
 
 
-    def generate_service(self, output_folder: Path, servicename: str, service: ServiceDescriptor, namespace: str | None, max_msg_size: str):
+    def generate_service(self, output_folder: Path, servicename: str, service: ServiceDescriptor, namespace: str | None, max_msg_size: str, compression_threshold: int,
+                         pmr_structs: set[str] | None = None) -> list[str]:
+        files = []
         template = self.jinja_env.get_template("method_id.hpp.txt")
         ids = service.get_list_of_method_ids()
         src = template.render(preamble=self.preamble, list_of_method_ids=ids, servicename=servicename, namespace=namespace)
-        Path(output_folder).mkdir(parents=True, exist_ok=True)
-        file_path = Path(output_folder) / f'{servicename.lower()}_method_id.hpp'
-        file_path.write_text(src)
+        files.append(self.write_output(output_folder, f'{servicename.lower()}_method_id.hpp', src))
         
         names = [
             'service.hpp',
             'service.cpp',
             'client.hpp',
             'client.cpp',
-            'client_test.cpp'
+            'client_test.cpp',
+            'async_client.hpp',
+            'async_client.cpp',
+            'pooled_client.hpp',
+            'pooled_client.cpp',
+            'load_test.cpp'
         ]
         client_includes = set()
         for method in service.methods:
@@ -262,21 +495,27 @@ class GeneratorCPP:
             include2 = f'{method[2].lower()}'
             client_includes.add(include1)
             client_includes.add(include2)
+        client_includes = sorted(client_includes)
+        compression_thresholds = {method[0]: str(compression_threshold) if 'compress' in method[3] else 'vst::NO_COMPRESSION' for method in service.methods}
 
         for name in names:
             template = self.jinja_env.get_template(f"{name}.txt")
             src = template.render(
                 preamble=self.preamble,
                 servicename=servicename, 
-                methodnames=list(service.methodnames), 
+                methodnames=[method[0] for method in service.methods], 
                 list_of_method_ids=ids, 
                 methods=service.methods,
+                unary_methods=service.get_unary_methods(),
+                stream_methods=service.get_stream_methods(),
                 client_includes=client_includes,
+                compression_thresholds=compression_thresholds,
+                has_offloaded=service.has_attribute('offload'),
+                pmr=not pmr_structs is None,
+                pmr_structs=pmr_structs or set(),
                 namespace=namespace,
                 max_msg_size=max_msg_size)
-            Path(output_folder).mkdir(parents=True, exist_ok=True)
-            file_path = Path(output_folder) / f'{servicename.lower()}_{name}'
-            file_path.write_text(src)
+            files.append(self.write_output(output_folder, f'{servicename.lower()}_{name}', src))
 
         for method in service.methods:
             methodname = method[0]
@@ -285,30 +524,34 @@ class GeneratorCPP:
             for name in ['hpp', 'cpp']:
                 template = self.jinja_env.get_template(f'service_method.{name}.txt')
                 src = template.render(preamble=self.preamble, servicename=servicename.lower(), methodname=methodname.lower(), 
-                                      request=request, response=response, namespace=namespace)
-                Path(output_folder).mkdir(parents=True, exist_ok=True)
-                file_path = Path(output_folder) / f'{servicename.lower()}_{methodname}.{name}'
-                file_path.write_text(src)
+                                      request=request, response=response, is_stream='stream' in method[3],
+                                      pmr=not pmr_structs is None, pmr_structs=pmr_structs or set(), namespace=namespace)
+                files.append(self.write_output(output_folder, f'{servicename.lower()}_{methodname}.{name}', src))
+        return files
 
 
     def generate_vst(self, output_folder: Path) -> None:
         Logger.log(None, LoggerLevel.INFO, f'Generating framework sources')
         vst_filenames = [
             'vst_client.hpp',
+            'vst_async_client.hpp',
+            'vst_client_pool.hpp',
+            'vst_arena.hpp',
             'vst_buffer.hpp',
+            'vst_compression.hpp',
             'vst_connection.hpp',
-            'vst_connection.hpp',
+            'vst_histogram.hpp',
             'vst_io_context_pool.hpp',
             'vst_log_mockup.hpp',
             'vst_message.hpp',
-            'vst_server.hpp'
+            'vst_metrics.hpp',
+            'vst_server.hpp',
+            'vst_worker_pool.hpp'
         ]
         for name in vst_filenames:
             template = self.jinja_env.get_template(f"{name}.txt")
             src = template.render(preamble=self.preamble)
-            Path(output_folder).mkdir(parents=True, exist_ok=True)
-            file_path = Path(output_folder) / name
-            file_path.write_text(src)
+            self.write_output(output_folder, name, src)
         Logger.log(None, LoggerLevel.INFO, f'framework sources generated ok')
 
     
@@ -316,46 +559,59 @@ class GeneratorCPP:
         Logger.log(None, LoggerLevel.INFO, f'Generating readme.1st')
         template = self.jinja_env.get_template("readme.1st.txt")
     
-        servicenames = set()
-        structurenames = set()
-        servicemethods = set()
+        servicenames = []
+        structurenames = []
+        servicemethods = []
+        unary_methodnames = {}
     
         for structname, struct in ast_processor.structs.items():
-            structurenames.add(structname) 
+            structurenames.append(structname) 
 
         for servicename, service in ast_processor.services.items():
-            servicenames.add(servicename)
+            servicenames.append(servicename)
+            unary_methodnames[servicename] = [method[0] for method in service.get_unary_methods()]
             for method in service.methods:
-                servicemethods.add(f'{servicename.lower()}_{method[0].lower()}')
+                servicemethods.append(f'{servicename.lower()}_{method[0].lower()}')
     
         src = template.render(
             project=self.project,
             version=self.version,
-            servicenames=list(servicenames),
-            structurenames=list(structurenames),
-            servicemethods=list(servicemethods)
+            servicenames=servicenames,
+            structurenames=structurenames,
+            servicemethods=servicemethods,
+            unary_methodnames=unary_methodnames
         )
-        Path(output_folder).mkdir(parents=True, exist_ok=True)
-        file_path = Path(output_folder) / "readme.1st"
-        file_path.write_text(src)
+        self.write_output(output_folder, "readme.1st", src)
         Logger.log(None, LoggerLevel.INFO, f'readme.1st generated ok')
 
 
     def generate(self, sourceFile: Path, outputDir: Path, boost_pathname: str, max_msg_size: str) -> None:
-        with sourceFile.open() as f:
-            sourceCode = f.read()
         Logger.log(None, LoggerLevel.INFO, f'Parsing IDL file {sourceFile}')
-        parser = ASTProcessor.build_parser()
-        ast = parser.parse(sourceCode)
-        astp = ASTProcessor()
-        astp.process_ast(ast)
+        astp = ASTProcessor.from_file(sourceFile, self.rpc_version, self.cache_dir)
+        if astp is None:
+            Logger.log(None, LoggerLevel.ERROR, f'IDL file {sourceFile} is not valid, nothing generated')
+            return
         Logger.log(None, LoggerLevel.INFO, f'IDL file {sourceFile} parsed ok.')
+        self.manifest = dict()
+        self.module_manifest = dict()
+        self.previous_manifest = self.read_manifest(outputDir)
+        self.written_files = 0
+        self.unchanged_files = 0
+        # structures and services are generated again only for changed modules
+        modules = self.select_modules(astp, outputDir, Path(sourceFile).resolve().parent, max_msg_size)
         self.generate_header(outputDir)
-        self.generate_structs(astp, outputDir)
-        self.generate_services(astp, outputDir, max_msg_size)
+        self.generate_structs(astp, outputDir, {structname for module in modules.values() for structname in module.structs})
+        service_files = self.generate_services(astp, outputDir, max_msg_size, {servicename for module in modules.values() for servicename in module.services})
+        for name, module in modules.items():
+            files = [f'{structname.lower()}.hpp' for structname in module.structs]
+            files += [file for servicename in module.services for file in service_files[servicename]]
+            self.module_manifest[name]['files'] = sorted(files)
         self.generate_cmake(astp, self.project, self.version, outputDir, boost_pathname)
+        self.generate_codec_benchmark(astp, outputDir)
         self.generate_vst(outputDir)
         self.generate_readme1st(astp, outputDir)
+        self.write_manifest(outputDir)
+        Logger.log(None, LoggerLevel.INFO, f'{self.written_files} files written, {self.unchanged_files} files unchanged')
         Logger.log(None, LoggerLevel.INFO, f'IDL file {sourceFile} processed ok.')
         Logger.log(None, LoggerLevel.INFO, f'C++ source files and CMake project descriptor genearated at {outputDir}')
     
\ No newline at end of file
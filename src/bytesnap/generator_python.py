@@ -0,0 +1,223 @@
+from datetime import datetime
+import keyword
+import os
+from pathlib import Path
+import struct
+from bytesnap.logger import Logger, LoggerLevel
+
+from bytesnap.generator_cpp import DEFAULT_CACHE_DIR, create_environment
+from bytesnap.parser import ASTProcessor, StructDescriptor
+
+
+class GeneratorPython:
+
+
+    def __init__(self, project: str, version: str, description: str, author: str, rpc_version: str, timestamp: bool = False,
+                 cache_dir: Path | None = DEFAULT_CACHE_DIR) -> None:
+        # struct module format characters of the numeric types
+        self.format_table = {
+            'uint8_t': 'B',
+            'uint16_t': 'H',
+            'uint32_t': 'I',
+            'uint64_t': 'Q',
+            'int8_t': 'b',
+            'int16_t': 'h',
+            'int32_t': 'i',
+            'int64_t': 'q',
+            'float': 'f',
+            'double': 'd'
+        }
+        # integers written as varints (zigzag for signed) by the compact encoding
+        self.varint_typenames = {
+            'uint16_t', 'uint32_t', 'uint64_t',
+            'int16_t', 'int32_t', 'int64_t'
+        }
+
+        # names a field can not take in the generated class: its methods and the names its defaults evaluate in the class body
+        self.reserved_names = {'encode', 'encode_into', 'decode', 'decode_from', 'field', 'numpy', 'codec'}
+
+        self.project = project
+        self.version = version
+        self.description = description
+        self.rpc_version = rpc_version
+        self.cache_dir = cache_dir
+        self.written_files = 0
+        self.unchanged_files = 0
+
+        Logger.log(None, LoggerLevel.INFO, f'Loading templates')
+        self.templates_path = Path(os.path.realpath(__file__)).parent / 'templates'
+        self.jinja_env = create_environment(self.templates_path, cache_dir)
+        template = self.jinja_env.get_template("preamble.py.txt")
+        self.preamble = template.render(
+            project=project, version=version, description=description, author=author,
+            date=datetime.now().strftime("%Y-%m-%d %H:%M:%S") if timestamp else None,
+            rpc_version=rpc_version)
+        Logger.log(None, LoggerLevel.INFO, f'Templates loaded ok')
+
+
+    def write_output(self, output_folder: Path, name: str, content: str) -> str:
+        # rewrite the file only if its content changed
+        Path(output_folder).mkdir(parents=True, exist_ok=True)
+        file_path = Path(output_folder) / name
+        if file_path.is_file() and file_path.read_text() == content:
+            self.unchanged_files += 1
+            return name
+        file_path.write_text(content)
+        self.written_files += 1
+        return name
+
+
+    def generate_codec(self, output_folder: Path) -> None:
+        Logger.log(None, LoggerLevel.INFO, f'Generating bytesnap_codec.py')
+        template = self.jinja_env.get_template("bytesnap_codec.py.txt")
+        content = template.render(preamble=self.preamble)
+        self.write_output(output_folder, "bytesnap_codec.py", content)
+        Logger.log(None, LoggerLevel.INFO, f'bytesnap_codec.py generated ok')
+
+
+    def sorted_structnames(self, structs: dict[str, StructDescriptor]) -> list[str]:
+        # structures after the structures they hold, the dataclass defaults construct them
+        result = []
+        visited = set()
+        def visit(structname: str) -> None:
+            if structname in visited:
+                return
+            visited.add(structname)
+            for fieldname in structs[structname].field_names:
+                field = structs[structname].fields[fieldname]
+                if field.is_userdefined:
+                    visit(field.typename)
+            result.append(structname)
+        for structname in structs:
+            visit(structname)
+        return result
+
+
+    def generate_structs(self, ast_processor: ASTProcessor, output_folder: Path) -> None:
+        Logger.log(None, LoggerLevel.INFO, f'Generating structures')
+        compact = ast_processor.options.get('encoding', 'fixed') == 'compact'
+        structs = [self.struct_context(structname, ast_processor.structs[structname], compact)
+                   for structname in self.sorted_structnames(ast_processor.structs)]
+        services = [{'name': servicename, 'ids': service.get_list_of_method_ids()}
+                    for servicename, service in ast_processor.services.items()]
+        template = self.jinja_env.get_template('structs.py.txt')
+        content = template.render(preamble=self.preamble,
+                                  project=self.project,
+                                  structs=structs,
+                                  services=services,
+                                  compact=compact)
+        self.write_output(output_folder, f'{self.project.lower()}_structs.py', content)
+        Logger.log(None, LoggerLevel.INFO, f'Structures generated ok')
+
+
+    def struct_context(self, structname: str, struct_descriptor: StructDescriptor, compact: bool) -> dict:
+        # precompute everything structs.py.txt needs, a codec plan entry selects the struct_codec.py.txt macros.
+        # consecutive fixed-width scalars are packed by one precompiled struct.Struct
+        fields = []
+        plan = []
+        runs = []
+        names = self.python_names(struct_descriptor)
+        for idl_fieldname in struct_descriptor.field_names:
+            field = struct_descriptor.fields[idl_fieldname]
+            fieldname = names[idl_fieldname]
+            varint = compact and field.typename in self.varint_typenames
+            annotation, default = self.field_declaration(field.typename, field.is_vector, field.is_userdefined,
+                                                         field.length_spec, field.assigned_value)
+            fields.append({
+                'name': fieldname,
+                'annotation': annotation,
+                'default': default,
+                'array': field.is_vector and field.typename in self.format_table
+            })
+
+            if field.is_vector:
+                if field.typename == 'string':
+                    plan.append({'kind': 'vector_string', 'name': fieldname})
+                elif field.is_userdefined:
+                    plan.append({'kind': 'vector_struct', 'name': fieldname, 'typename': field.typename})
+                else:
+                    plan.append({'kind': 'varint_array' if varint else 'array', 'name': fieldname, 'dtype': f'codec.{field.typename.upper()}'})
+            elif field.typename == 'string':
+                plan.append({'kind': 'string', 'name': fieldname})
+            elif field.is_userdefined:
+                plan.append({'kind': 'struct', 'name': fieldname, 'typename': field.typename})
+            elif varint:
+                signedness = 'signed' if field.typename.startswith('int') else 'unsigned'
+                plan.append({'kind': f'compact_{signedness}', 'name': fieldname, 'bits': struct.calcsize(self.format_table[field.typename]) * 8})
+            else:
+                if not plan or plan[-1]['kind'] != 'run':
+                    run = {'kind': 'run', 'struct': f'_{structname.upper()}_RUN_{len(runs)}', 'names': [], 'format': '<'}
+                    runs.append(run)
+                    plan.append(run)
+                plan[-1]['names'].append(fieldname)
+                plan[-1]['format'] += self.format_table[field.typename]
+        for run in runs:
+            run['size'] = struct.calcsize(run['format'])
+
+        return {
+            'name': structname,
+            'fields': fields,
+            'plan': plan,
+            'runs': runs
+        }
+
+
+    def python_names(self, struct_descriptor: StructDescriptor) -> dict[str, str]:
+        # Python identifiers of the fields, keywords and reserved names get trailing underscores, the wire format has no names.
+        # Structures a field refers to are reserved as well, the class body evaluates them as default factories
+        reserved = self.reserved_names | {field.typename for field in struct_descriptor.fields.values() if field.is_userdefined}
+        taken = set(struct_descriptor.field_names)
+        names = dict()
+        for fieldname in struct_descriptor.field_names:
+            name = fieldname
+            if keyword.iskeyword(name) or name in reserved:
+                name += '_'
+                while name in taken:
+                    name += '_'
+                taken.add(name)
+            names[fieldname] = name
+        return names
+
+
+    def field_declaration(self, typename: str, is_vector: bool, is_userdefined: bool,
+                          length_spec: int | None, assigned_value: int | float | str | list | None) -> tuple[str, str]:
+        # type annotation and dataclass default, matching the initial value of the C++ member
+        if is_vector:
+            if typename in self.format_table:
+                dtype = f'codec.{typename.upper()}'
+                if not assigned_value is None:
+                    factory = f"lambda: numpy.array([{', '.join(str(v) for v in assigned_value)}], {dtype})"
+                else:
+                    factory = f'lambda: numpy.zeros({length_spec or 0}, {dtype})'
+                return 'numpy.ndarray', f'field(default_factory={factory})'
+            element = 'str' if typename == 'string' else typename
+            if not assigned_value is None:
+                factory = f"lambda: [{', '.join(str(v) for v in assigned_value)}]"
+            elif not length_spec is None:
+                factory = f"lambda: [''] * {length_spec}" if typename == 'string' else f'lambda: [{typename}() for _ in range({length_spec})]'
+            else:
+                factory = 'list'
+            return f'list[{element}]', f'field(default_factory={factory})'
+        if is_userdefined:
+            return typename, f'field(default_factory={typename})'
+        if typename == 'string':
+            return 'str', "''" if assigned_value is None else str(assigned_value)
+        if typename in ('float', 'double'):
+            return 'float', '0.0' if assigned_value is None else str(assigned_value)
+        return 'int', '0' if assigned_value is None else str(assigned_value)
+
+
+    def generate(self, sourceFile: Path, outputDir: Path) -> None:
+        Logger.log(None, LoggerLevel.INFO, f'Parsing IDL file {sourceFile}')
+        astp = ASTProcessor.from_file(sourceFile, self.rpc_version, self.cache_dir)
+        if astp is None:
+            Logger.log(None, LoggerLevel.ERROR, f'IDL file {sourceFile} is not valid, nothing generated')
+            return
+        Logger.log(None, LoggerLevel.INFO, f'IDL file {sourceFile} parsed ok.')
+        self.written_files = 0
+        self.unchanged_files = 0
+        self.generate_codec(outputDir)
+        self.generate_structs(astp, outputDir)
+        Logger.log(None, LoggerLevel.INFO, f'{self.written_files} files written, {self.unchanged_files} files unchanged')
+        Logger.log(None, LoggerLevel.INFO, f'IDL file {sourceFile} processed ok.')
+        Logger.log(None, LoggerLevel.INFO, f'Python source files generated at {outputDir}')
@@ -1,4 +1,9 @@
-from lark import Lark, ParseTree
+import hashlib
+import os
+import pickle
+from pathlib import Path
+import lark
+from lark import Lark, ParseTree, Token
 
 from bytesnap.logger import Logger, LoggerLevel
 
@@ -48,35 +53,83 @@ class ServiceDescriptor:
     
 
     def __str__(self) -> str:
-        output_string = ''.join(f"\n\t{v[0]} : {v[1]} -> {v[2]}" for v in self.methods)
+        output_string = ''.join(f"\n\t{v[0]} : {v[1]} -> {v[2]} {sorted(v[3])}" for v in self.methods)
         return f'ServiceDescriptor: methods:{output_string}'
     
 
-    def append_method(self, methodname: str, requestname: str, responsename: str) -> bool:
+    def append_method(self, methodname: str, requestname: str, responsename: str, attributes: set[str] | None = None) -> bool:
         if methodname in self.methodnames:
             return False
         self.methodnames.add(methodname)
-        self.methods.append((methodname, requestname, responsename))
+        self.methods.append((methodname, requestname, responsename, set() if attributes is None else attributes))
         return True
+
+
+    def has_attribute(self, attribute: str) -> bool:
+        return any(attribute in method[3] for method in self.methods)
     
 
+    def get_unary_methods(self) -> list[tuple[str, str, str, set[str]]]:
+        return [method for method in self.methods if 'stream' not in method[3]]
+
+
+    def get_stream_methods(self) -> list[tuple[str, str, str, set[str]]]:
+        return [method for method in self.methods if 'stream' in method[3]]
+
+
     def get_list_of_method_ids(self) -> list[tuple[int, str]]:
-        return list(enumerate(self.methodnames))
+        # ids follow the declaration order, so they are stable between runs
+        return [(id, method[0]) for id, method in enumerate(self.methods)]
+
+
+class ModuleDescriptor:
+
+
+    def __init__(self, name: str, imports: list[str]) -> None:
+        self.name = name
+        self.imports = imports
+        self.key = None
+        self.constants = dict()
+        self.structs = dict()
+        self.services = dict()
+        self.options = dict()
+
+
+    def __str__(self) -> str:
+        return f'ModuleDescriptor: name={self.name}, imports={self.imports}, constants={list(self.constants)}, structs={list(self.structs)}, services={list(self.services)}'
 
 
 class ASTProcessor:
 
+    # LALR parser, built once per process
+    parser = None
+
 
     def __init__(self) -> None:
         self.constants = dict()
         self.structs = dict()
         self.services = dict()
         self.options = dict()
+        # modules of the IDL, imported modules before the modules importing them, the main module last
+        self.modules = dict()
         self.standard_typenames = {
             'uint8_t', 'uint16_t', 'uint32_t', 'uint64_t',
             'int8_t', 'int16_t', 'int32_t', 'int64_t',
             'float', 'double', 'string'
         }
+        self.method_attributes = {
+            'offload'
+        }
+        self.compression_codecs = {
+            'none', 'zlib'
+        }
+        self.compression_threshold = 1024
+        self.encodings = {
+            'fixed', 'compact'
+        }
+        self.allocators = {
+            'std', 'pmr'
+        }
 
     
     def get_node_location(self, node: ParseTree) -> tuple[int, int]:
@@ -87,6 +140,15 @@ class ASTProcessor:
 
 
     def process_ast(self, ast: ParseTree) -> bool:
+        if not self.process_definitions(ast):
+            return False
+        return self.process_global_options()
+
+
+    def process_definitions(self, ast: ParseTree) -> bool:
+        # definitions already known come from imported modules and are validated there
+        known_structs = set(self.structs)
+        known_services = set(self.services)
         for child in ast.children:
             if not self.process_constant(child):
                 return False
@@ -94,13 +156,13 @@ class ASTProcessor:
             if not self.process_struct(child):
                 return False
         for structname, struct in self.structs.items():
-            if not self.validate_struct(structname, struct):
+            if not structname in known_structs and not self.validate_struct(structname, struct):
                 return False
         for child in ast.children:
             if not self.process_service(child):
                 return False
         for servicename, service in self.services.items():
-            if not self.validate_service(servicename, service):
+            if not servicename in known_services and not self.validate_service(servicename, service):
                 return False
         for child in ast.children:
             if not self.process_options(child):
@@ -108,6 +170,44 @@ class ASTProcessor:
         return True
 
 
+    def process_global_options(self) -> bool:
+        if not self.process_compression_options():
+            return False
+        if not self.process_encoding_options():
+            return False
+        if not self.process_allocator_options():
+            return False
+        return True
+
+
+    @staticmethod
+    def process_import(node: ParseTree) -> str | None:
+        if node.children[0].data == "import":
+            return node.children[0].children[0].value[1:-1]
+        return None
+
+
+    def merge_module(self, module: ModuleDescriptor) -> bool:
+        # add the definitions of a validated module, names are shared by all modules
+        for name, value in module.constants.items():
+            if name in self.constants:
+                Logger.log(None, LoggerLevel.ERROR, f'module {module.name}: constant {name} redefinition')
+                return False
+            self.constants[name] = value
+        for name, struct in module.structs.items():
+            if name in self.structs or name in self.constants:
+                Logger.log(None, LoggerLevel.ERROR, f'module {module.name}: structure {name} redefinition')
+                return False
+            self.structs[name] = struct
+        for name, service in module.services.items():
+            if name in self.services or name in self.structs or name in self.constants:
+                Logger.log(None, LoggerLevel.ERROR, f'module {module.name}: service {name} redefinition')
+                return False
+            self.services[name] = service
+        self.modules[module.name] = module
+        return True
+
+
     def process_options(self, node: ParseTree) -> bool:
         if node.children[0].data == "options":
             for option in node.children[0].children:
@@ -117,6 +217,48 @@ class ASTProcessor:
         return True
     
 
+    def process_compression_options(self) -> bool:
+        compression = self.options.get('compression', 'none')
+        if not compression in self.compression_codecs:
+            Logger.log(None, LoggerLevel.ERROR, f'option compression: unknown codec {compression}, expected one of {sorted(self.compression_codecs)}')
+            return False
+        threshold = self.options.get('compression_threshold', str(self.compression_threshold))
+        if not threshold.isdigit():
+            Logger.log(None, LoggerLevel.ERROR, f'option compression_threshold: {threshold} is not a number of bytes')
+            return False
+        self.compression_threshold = int(threshold)
+        if compression == 'none':
+            return True
+        # compressed services or service.method names, all methods by default
+        compressed = [name.strip() for name in self.options.get('compressed', '').split(',') if name.strip()]
+        for name in compressed:
+            servicename, _, methodname = name.partition('.')
+            if not servicename in self.services or (methodname and not methodname in self.services[servicename].methodnames):
+                Logger.log(None, LoggerLevel.ERROR, f'option compressed: undefined service or method {name}')
+                return False
+        for servicename, service in self.services.items():
+            for method in service.methods:
+                if not compressed or servicename in compressed or f'{servicename}.{method[0]}' in compressed:
+                    method[3].add('compress')
+        return True
+
+
+    def process_encoding_options(self) -> bool:
+        encoding = self.options.get('encoding', 'fixed')
+        if not encoding in self.encodings:
+            Logger.log(None, LoggerLevel.ERROR, f'option encoding: unknown encoding {encoding}, expected one of {sorted(self.encodings)}')
+            return False
+        return True
+
+
+    def process_allocator_options(self) -> bool:
+        allocator = self.options.get('allocator', 'std')
+        if not allocator in self.allocators:
+            Logger.log(None, LoggerLevel.ERROR, f'option allocator: unknown allocator {allocator}, expected one of {sorted(self.allocators)}')
+            return False
+        return True
+
+
     def process_constant(self, node: ParseTree) -> bool:
         if node.children[0].data == "const":
             name = node.children[0].children[0]
@@ -142,10 +284,23 @@ class ASTProcessor:
                 return False
             servciedescriptor = ServiceDescriptor()
             for method in node.children[0].children[1:]:
-                methodname = method.children[0].value
-                requestname = method.children[1].value
-                responsename = method.children[2].value
-                if not servciedescriptor.append_method(methodname=methodname, requestname=requestname, responsename=responsename):
+                methodname, requestname, responsename = [child.value for child in method.children if isinstance(child, Token)]
+                attributes = set()
+                for child in method.children:
+                    if isinstance(child, Token):
+                        continue
+                    if child.data == 'stream_modifier':
+                        attributes.add('stream')
+                        continue
+                    for attribute in child.children:
+                        if not attribute.value in self.method_attributes:
+                            Logger.log(self.get_node_location(method), LoggerLevel.ERROR, f'method {methodname}: unknown attribute {attribute.value}')
+                            return False
+                        attributes.add(attribute.value)
+                if 'stream' in attributes and 'offload' in attributes:
+                    Logger.log(self.get_node_location(method), LoggerLevel.ERROR, f'method {methodname}: streaming methods can not be offloaded')
+                    return False
+                if not servciedescriptor.append_method(methodname=methodname, requestname=requestname, responsename=responsename, attributes=attributes):
                     Logger.log(self.get_node_location(node), LoggerLevel.ERROR, f'method with name {method} already defined')
                     return False
             self.services[name] = servciedescriptor
@@ -334,11 +489,171 @@ class ASTProcessor:
 
 
     @staticmethod
-    def build_parser():
+    def cache_key(source_code: str, version: str) -> str:
+        # the result depends on the IDL, the generator version, this module and the Lark version
+        digest = hashlib.sha256()
+        digest.update(version.encode())
+        digest.update(lark.__version__.encode())
+        digest.update(Path(__file__).read_bytes())
+        digest.update(source_code.encode())
+        return digest.hexdigest()
+
+
+    @staticmethod
+    def read_cache(cache_dir: Path | None, name: str) -> object | None:
+        if cache_dir is None:
+            return None
+        cache_path = Path(cache_dir) / name
+        if not cache_path.is_file():
+            return None
+        # the cache is only an optimization: a corrupt or stale file (unpickling can raise almost anything,
+        # e.g. for classes renamed or moved since it was written) is ignored and the module parsed again
+        try:
+            with cache_path.open('rb') as f:
+                return pickle.load(f)
+        except Exception:
+            Logger.log(None, LoggerLevel.WARNING, f'Ignoring unreadable IDL cache file {cache_path}')
+            return None
+
+
+    @staticmethod
+    def write_cache(cache_dir: Path | None, name: str, value: object) -> None:
+        # written to a temporary file first, so concurrent runs never read a partial file
+        if cache_dir is None:
+            return
+        cache_path = Path(cache_dir) / name
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+            with tmp_path.open('wb') as f:
+                pickle.dump(value, f)
+            tmp_path.replace(cache_path)
+        except OSError:
+            Logger.log(None, LoggerLevel.WARNING, f'Can not write IDL cache file {cache_path}')
+
+
+    @staticmethod
+    def parse(source_code: str, name: str) -> ParseTree | None:
+        try:
+            return ASTProcessor.build_parser().parse(source_code)
+        except lark.exceptions.UnexpectedInput as e:
+            Logger.log(None, LoggerLevel.ERROR, f'module {name}: {str(e).strip()}')
+            return None
+
+
+    @staticmethod
+    def from_file(path: Path, version: str, cache_dir: Path | None = None) -> 'ASTProcessor | None':
+        # load the IDL file and the modules it imports, then apply the options of the main module to all of them
+        modules = dict()
+        if not ASTProcessor.load_module(Path(path).resolve(), version, cache_dir, modules, []):
+            return None
+        processor = ASTProcessor()
+        for module in modules.values():
+            if not processor.merge_module(module):
+                return None
+        main_module = next(reversed(modules.values()))
+        for module in modules.values():
+            if module.options and not module is main_module:
+                Logger.log(None, LoggerLevel.ERROR, f'module {module.name}: options are only allowed in the main IDL file')
+                return None
+        processor.options = dict(main_module.options)
+        if not processor.process_global_options():
+            return None
+        return processor
+
+
+    @staticmethod
+    def load_module(path: Path, version: str, cache_dir: Path | None, modules: dict[str, ModuleDescriptor], importing: list[str]) -> bool:
+        # depth first over the import graph, modules are added after everything they import.
+        # A module is parsed and validated again only if its source or the source of a module
+        # it imports (directly or not) changed, otherwise it is loaded from the cache.
+        name = str(path)
+        if name in modules:
+            return True
+        if name in importing:
+            Logger.log(None, LoggerLevel.ERROR, f'circular import: {" -> ".join(importing[importing.index(name):] + [name])}')
+            return False
+        try:
+            source_code = path.read_text()
+        except OSError as e:
+            Logger.log(None, LoggerLevel.ERROR, f'module {importing[-1] if importing else name}: can not read {name}: {e}')
+            return False
+        source_key = ASTProcessor.cache_key(source_code, version)
+
+        ast = None
+        imports = ASTProcessor.read_cache(cache_dir, f'{source_key}.imports')
+        if imports is None:
+            ast = ASTProcessor.parse(source_code, name)
+            if ast is None:
+                return False
+            imports = [imported for imported in (ASTProcessor.process_import(child) for child in ast.children) if not imported is None]
+            ASTProcessor.write_cache(cache_dir, f'{source_key}.imports', imports)
+        # imports are relative to the importing file
+        import_paths = [str((path.parent / imported).resolve()) for imported in imports]
+        for import_path in import_paths:
+            if not ASTProcessor.load_module(Path(import_path), version, cache_dir, modules, importing + [name]):
+                return False
+
+        digest = hashlib.sha256(source_key.encode())
+        for import_path in import_paths:
+            digest.update(modules[import_path].key.encode())
+        key = digest.hexdigest()
+        module = ASTProcessor.read_cache(cache_dir, f'{key}.pickle')
+        if module is None:
+            if ast is None:
+                ast = ASTProcessor.parse(source_code, name)
+                if ast is None:
+                    return False
+            module = ASTProcessor.process_module(name, ast, import_paths, modules)
+            if module is None:
+                return False
+            module.key = key
+            ASTProcessor.write_cache(cache_dir, f'{key}.pickle', module)
+        # the same source may be cached for another location
+        module.name = name
+        module.imports = import_paths
+        modules[name] = module
+        return True
+
+
+    @staticmethod
+    def process_module(name: str, ast: ParseTree, import_paths: list[str], modules: dict[str, ModuleDescriptor]) -> ModuleDescriptor | None:
+        # validate the module against the definitions of the modules it imports, directly or not
+        dependencies = set()
+        pending = list(import_paths)
+        while pending:
+            dependency = pending.pop()
+            if not dependency in dependencies:
+                dependencies.add(dependency)
+                pending.extend(modules[dependency].imports)
+        processor = ASTProcessor()
+        for dependency, dependency_module in modules.items():
+            if dependency in dependencies and not processor.merge_module(dependency_module):
+                return None
+        module = ModuleDescriptor(name, import_paths)
+        known_constants = set(processor.constants)
+        known_structs = set(processor.structs)
+        known_services = set(processor.services)
+        if not processor.process_definitions(ast):
+            Logger.log(None, LoggerLevel.ERROR, f'module {name} is not valid')
+            return None
+        module.constants = {key: value for key, value in processor.constants.items() if not key in known_constants}
+        module.structs = {key: value for key, value in processor.structs.items() if not key in known_structs}
+        module.services = {key: value for key, value in processor.services.items() if not key in known_services}
+        module.options = processor.options
+        return module
+
+
+    @staticmethod
+    def build_parser() -> Lark:
+        if not ASTProcessor.parser is None:
+            return ASTProcessor.parser
         grammar = '''
 start: definition+
 
-definition: const | struct | service | options
+definition: import | const | struct | service | options
+
+import: "import" STRING
 
 options: "options" "{" option+ "}"
 
@@ -374,10 +689,15 @@ const_name: NAME
 
 service: "service" NAME "{" service_method+ "}"
 
-service_method: NAME ":" NAME "->" NAME
+service_method: NAME ":" NAME "->" (stream_modifier)? NAME (method_attributes)?
+
+stream_modifier: STREAM
+
+method_attributes: "[" NAME ("," NAME)* "]"
 
-HEX_INT: "0x" /[0-9A-Fa-f]+/
-BIN_INT: "0b" /[01]+/
+STREAM: "stream"
+HEX_INT.2: "0x" /[0-9A-Fa-f]+/
+BIN_INT.2: "0b" /[01]+/
 
 %import common.CNAME -> NAME
 %import common.INT
@@ -390,4 +710,7 @@ COMMENT: "#" /[^\\n]*/ _NEWLINE
 _NEWLINE: "\\n"
 %ignore COMMENT
 '''
-        return Lark(grammar, start='start', propagate_positions=True)
+        # the contextual LALR lexer still accepts keywords as names where no keyword is expected,
+        # the analysed grammar is cached on disk by Lark
+        ASTProcessor.parser = Lark(grammar, start='start', parser='lalr', propagate_positions=True, cache=True)
+        return ASTProcessor.parser
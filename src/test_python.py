@@ -0,0 +1,213 @@
+import importlib
+import os
+import random
+import subprocess
+import tempfile
+import shutil
+import sys
+from pathlib import Path
+import numpy
+from bytesnap.generator_cpp import GeneratorCPP
+from bytesnap.generator_python import GeneratorPython
+from bytesnap.logger import Logger, LoggerLevel
+
+
+# Cross-language test of the Python codec: random samples of examples/types are encoded by Python,
+# decoded and encoded again by the generated C++ structures, the bytes must be identical both ways.
+
+DEFAULT_BOOST_PATH = '/usr/include/boost'
+SAMPLES = 200
+
+ROUNDTRIP_CMAKE = '''cmake_minimum_required(VERSION 3.16)
+project(types_roundtrip LANGUAGES CXX)
+set(CMAKE_CXX_STANDARD 20)
+set(CMAKE_CXX_STANDARD_REQUIRED ON)
+add_executable(types_roundtrip roundtrip.cpp)
+target_include_directories(types_roundtrip PRIVATE ..)
+'''
+
+# decodes every file given, writes the encoding of the decoded structure to <file>.out if it decoded
+# completely, and the encoding of a default structure to default.bin
+ROUNDTRIP_CPP = '''#include <fstream>
+#include <iterator>
+#include "sample.hpp"
+
+int main(int argc, char** argv) {
+    for (int i = 1; i < argc; i++) {
+        std::ifstream input(argv[i], std::ios::binary);
+        std::vector<uint8_t> buffer((std::istreambuf_iterator<char>(input)), std::istreambuf_iterator<char>());
+        types::Sample sample;
+        bytesnap::reader reader(buffer);
+        if (!types::Sample::decode(sample, reader) || reader.tell() != buffer.size()) continue;
+        std::vector<uint8_t> output;
+        bytesnap::encode_exact(sample, output);
+        std::ofstream(std::string(argv[i]) + ".out", std::ios::binary).write(reinterpret_cast<const char*>(output.data()), output.size());
+    }
+    // scalars without a value in the IDL are left uninitialized by C++, Python sets them to 0
+    types::Sample sample;
+    sample.id = sample.flag = 0;
+    sample.scalars.u8 = sample.scalars.u16 = sample.scalars.u64 = 0;
+    sample.scalars.i8 = sample.scalars.i16 = sample.scalars.i32 = sample.scalars.i64 = 0;
+    sample.scalars.f32 = sample.origin.x = sample.origin.y = 0;
+    sample.keywords.from = sample.keywords.is = sample.keywords.numpy = sample.keywords.codec = 0;
+    sample.keywords.field = sample.keywords.pass.x = sample.keywords.pass.y = 0;
+    std::vector<uint8_t> output;
+    bytesnap::encode_exact(sample, output);
+    std::ofstream("default.bin", std::ios::binary).write(reinterpret_cast<const char*>(output.data()), output.size());
+    return 0;
+}
+'''
+
+
+def random_array(rng: random.Random, dtype: numpy.dtype) -> numpy.ndarray:
+    count = rng.choice([0, 1, rng.randrange(2, 40)])
+    if dtype.kind == 'f':
+        # float32 values, so that the float fields round trip exactly
+        return numpy.array([rng.uniform(-1e6, 1e6) for _ in range(count)], numpy.float32).astype(dtype)
+    info = numpy.iinfo(dtype)
+    # extremes and small values, the compact encoding has a different size for each
+    return numpy.array([rng.choice([info.min, info.max, 0, rng.randint(max(info.min, -300), min(info.max, 300)),
+                                    rng.randint(info.min, info.max)]) for _ in range(count)], dtype)
+
+
+def random_int(rng: random.Random, dtype: numpy.dtype) -> int:
+    info = numpy.iinfo(dtype)
+    return rng.choice([info.min, info.max, 0, 1, rng.randint(info.min, info.max)])
+
+
+def random_string(rng: random.Random) -> str:
+    return ''.join(rng.choice('abc é€\U0001f600') for _ in range(rng.randrange(0, 12)))
+
+
+def random_sample(structs, codec, rng: random.Random):
+    def point():
+        return structs.Point(float(numpy.float32(rng.uniform(-1, 1))), float(numpy.float32(rng.uniform(-1, 1))))
+
+    def vectors():
+        return structs.Vectors(*(random_array(rng, dtype) for dtype in (
+            codec.UINT8_T, codec.UINT16_T, codec.UINT32_T, codec.UINT64_T,
+            codec.INT8_T, codec.INT16_T, codec.INT32_T, codec.INT64_T, codec.FLOAT, codec.DOUBLE)),
+            names=[random_string(rng) for _ in range(rng.randrange(0, 4))],
+            points=[point() for _ in range(rng.randrange(0, 4))])
+
+    scalars = structs.Scalars(*(random_int(rng, dtype) for dtype in (
+        codec.UINT8_T, codec.UINT16_T, codec.UINT32_T, codec.UINT64_T,
+        codec.INT8_T, codec.INT16_T, codec.INT32_T, codec.INT64_T)),
+        f32=float(numpy.float32(rng.uniform(-1e9, 1e9))), f64=rng.uniform(-1e300, 1e300), name=random_string(rng))
+    return structs.Sample(
+        id=random_int(rng, codec.UINT64_T),
+        slots=random_array(rng, codec.INT32_T),
+        scalars=scalars,
+        origin=point(),
+        vectors=vectors(),
+        flag=random_int(rng, codec.UINT8_T),
+        paths=[vectors() for _ in range(rng.randrange(0, 3))],
+        note=random_string(rng),
+        # the Python names of the keyword fields have a trailing underscore
+        keywords=structs.Keywords(**{
+            'from_': random_int(rng, codec.UINT32_T),
+            'is_': random_int(rng, codec.UINT8_T),
+            'field_': rng.uniform(-1e300, 1e300),
+            'numpy_': random_int(rng, codec.UINT16_T),
+            'codec_': random_int(rng, codec.INT64_T),
+            'in_': random_array(rng, codec.INT16_T),
+            'None_': random_string(rng),
+            'lambda_': [random_string(rng) for _ in range(rng.randrange(0, 4))],
+            'pass_': point()}))
+
+
+def run_test(idl_name: str, tmp_dir_pathname: str, boost_dir_pathname: str) -> bool:
+    output_path = Path(tmp_dir_pathname) / idl_name
+    idl_path = Path(this_path) / f'examples/types/{idl_name}.txt'
+    GeneratorCPP(project='types', version='0.0.1', description='Bytesnap Python codec test', author='',
+                 rpc_version='0.1.0').generate(idl_path, output_path, boost_dir_pathname, 10000)
+    GeneratorPython(project='types', version='0.0.1', description='Bytesnap Python codec test', author='',
+                    rpc_version='0.1.0').generate(idl_path, output_path)
+
+    roundtrip_path = output_path / 'roundtrip'
+    roundtrip_path.mkdir()
+    (roundtrip_path / 'CMakeLists.txt').write_text(ROUNDTRIP_CMAKE)
+    (roundtrip_path / 'roundtrip.cpp').write_text(ROUNDTRIP_CPP)
+    for cmd in ['cmake -S . -B build', 'cmake --build build --config Debug']:
+        print("Executing command:", cmd)
+        try:
+            subprocess.check_output(cmd, cwd=roundtrip_path, shell=True, stderr=subprocess.STDOUT, text=True)
+        except subprocess.CalledProcessError as e:
+            print(f"Error! Return code: {e.returncode}")
+            print(e.output)
+            return False
+    executable = next((path for path in (roundtrip_path / 'build' / 'Debug' / 'types_roundtrip.exe',
+                                         roundtrip_path / 'build' / 'types_roundtrip') if path.exists()), None)
+    if executable is None:
+        print(f"Error! The roundtrip program was not built in '{roundtrip_path / 'build'}'")
+        return False
+
+    # the generated modules import each other by name, every encoding has its own
+    sys.path.insert(0, str(output_path))
+    for name in ['bytesnap_codec', 'types_structs']:
+        sys.modules.pop(name, None)
+    codec = importlib.import_module('bytesnap_codec')
+    structs = importlib.import_module('types_structs')
+    sys.path.pop(0)
+
+    rng = random.Random(idl_name)
+    samples = [random_sample(structs, codec, rng) for _ in range(SAMPLES)]
+    messages = [sample.encode() for sample in samples]
+    # truncated messages must be rejected by both codecs
+    truncated = [message[:rng.randrange(0, len(message))] for message in messages[:SAMPLES // 4]]
+    data_path = roundtrip_path / 'data'
+    data_path.mkdir()
+    for i, message in enumerate(messages + truncated):
+        (data_path / f'{i}.bin').write_bytes(message)
+    subprocess.check_call([str(executable)] + [f'{i}.bin' for i in range(len(messages) + len(truncated))], cwd=data_path)
+
+    we_are_good = True
+    for i, (sample, message) in enumerate(zip(samples, messages)):
+        output_file = data_path / f'{i}.bin.out'
+        if not output_file.exists():
+            print(f"Error! {idl_name}: C++ failed to decode sample {i}")
+            we_are_good = False
+        elif output_file.read_bytes() != message:
+            print(f"Error! {idl_name}: C++ encoding of sample {i} differs from the Python encoding")
+            we_are_good = False
+        elif not structs.Sample.decode(output_file.read_bytes()) == sample:
+            print(f"Error! {idl_name}: Python decoding of sample {i} differs from the sample")
+            we_are_good = False
+    for i, message in enumerate(truncated, len(messages)):
+        try:
+            structs.Sample.decode(message)
+            print(f"Error! {idl_name}: Python decoded the truncated message {i}")
+            we_are_good = False
+        except codec.DecodeError:
+            pass
+        if (data_path / f'{i}.bin.out').exists():
+            print(f"Error! {idl_name}: C++ decoded the truncated message {i}")
+            we_are_good = False
+    if (data_path / 'default.bin').read_bytes() != structs.Sample().encode():
+        print(f"Error! {idl_name}: default values differ between C++ and Python")
+        we_are_good = False
+    print(f'{idl_name}: {len(samples)} samples and {len(truncated)} truncated messages compared')
+    return we_are_good
+
+
+Logger(True, False).set_level(LoggerLevel.INFO)
+
+boost_dir_pathname = input(
+    f"Enter the boost path (leave blank for '{DEFAULT_BOOST_PATH}'): ")
+if boost_dir_pathname == '':
+    boost_dir_pathname = DEFAULT_BOOST_PATH
+
+this_path = os.path.dirname(os.path.realpath(__file__))
+
+tmp_dir_pathname = tempfile.mkdtemp()
+print(f'Created temporary directory for test output: "{tmp_dir_pathname}"')
+
+we_are_good = all([run_test(idl_name, tmp_dir_pathname, boost_dir_pathname) for idl_name in ['types', 'types_compact']])
+
+shutil.rmtree(tmp_dir_pathname)
+print(f'Temporary directory for test output "{tmp_dir_pathname}" deleted ok')
+
+if we_are_good:
+    print("*****************************")
+    print("Success! All tests passed OK.")
+    print("*****************************")